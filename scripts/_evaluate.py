@@ -16,6 +16,7 @@ from torchchimera.metrics import eval_si_sdr
 from _model_io import load_model
 from _training_common import AdaptedChimeraMagPhasebook
 from _training_common import exclude_silence
+from _script_common import dataloader_kwargs
 
 def add_evaluation_io_argument(parser):
     parser.add_argument('--data-dir', nargs='+', required=True, help="directory of validation dataset")
@@ -40,7 +41,8 @@ def evaluate(args):
     # build dataset
     dataset = FolderTuple(args.data_dir, args.sr, args.segment_duration)
     loader = torch.utils.data.DataLoader(
-        dataset, batch_size=args.batch_size, shuffle=False
+        dataset, batch_size=args.batch_size, shuffle=False,
+        **dataloader_kwargs(args, persistent_workers=False)
     )
 
     # load a model
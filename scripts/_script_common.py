@@ -1,19 +1,33 @@
 
+import os
 import math
 import torch
 from _training_common import StftSetting
 
 def add_general_argument(parser):
     parser.add_argument('--gpu', action='store_true', help='enable cuda device')
+    parser.add_argument('--num-workers', type=int, default=(os.cpu_count() or 2) // 2, help='num of dataloader workers')
+    parser.add_argument('--prefetch', type=int, default=4, help='num of batches prefetched by each worker')
     return parser
 
 def validate_general_argument(args, parser):
     if args.gpu and not torch.cuda.is_available():
         parser.error(f'cuda is not available')
+    if args.num_workers < 0:
+        parser.error('--num-workers is non-negative')
+    if args.prefetch <= 0:
+        parser.error('--prefetch is positive')
     # get prefered device
     args.device = torch.device('cuda' if args.gpu else 'cpu')
     return args
 
+def dataloader_kwargs(args, persistent_workers=True):
+    kwargs = {'num_workers': args.num_workers, 'pin_memory': args.gpu}
+    if args.num_workers > 0:
+        kwargs['persistent_workers'] = persistent_workers
+        kwargs['prefetch_factor'] = args.prefetch
+    return kwargs
+
 def add_feature_argument(parser):
     parser.add_argument('--sr', type=int, default=8000, help='sampling rate')
     parser.add_argument('--n-fft', type=int, default=256, help='num of fft point')
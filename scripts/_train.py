@@ -21,6 +21,7 @@ from _model_io import save_checkpoint
 from _training_common import AdaptedChimeraMagPhasebook
 from _training_common import compute_loss
 from _training_common import Stft, Istft
+from _script_common import dataloader_kwargs
 
 def add_training_io_argument(parser):
     parser.add_argument('--train-dir', nargs='+', required=True, help='directory of training dataset')
@@ -55,6 +56,7 @@ def add_training_argument(parser):
     parser.add_argument('--batch-size', type=int, default=32, help='batch size')
     parser.add_argument('--compute-batch-size', type=int, default=None, help='batch size for computation')
     parser.add_argument('--lr', type=float, help='learning rate. if not provided, 1e-3 (chimera++) or 1e-4 (wave-approximation) is set')
+    parser.add_argument('--log-interval', type=int, default=10, help='num of weight updates between training statistics output')
     parser.add_argument('--loss-function', required=True,
                         choices=('chimera++',
                                  'chimera++-csa',
@@ -81,19 +83,24 @@ def validate_training_argument(args, parser):
             0
     if args.lr <= 0:
         parser.error('--lr is positive')
+    if args.log_interval <= 0:
+        parser.error('--log-interval is positive')
     return args
 
 def train(args):
     # build dataset
     train_dataset = FolderTuple(args.train_dir, args.sr, args.segment_duration)
+    # workers must be respawned every epoch to see train_dataset.shuffle()
     train_loader = torch.utils.data.DataLoader(
-        train_dataset, batch_size=args.compute_batch_size, shuffle=True
+        train_dataset, batch_size=args.compute_batch_size, shuffle=True,
+        **dataloader_kwargs(args, persistent_workers=args.sync)
     )
     if args.validation_dir is not None:
         validation_dataset = FolderTuple(
             args.validation_dir, args.sr, args.segment_duration)
         validation_loader = torch.utils.data.DataLoader(
-            validation_dataset, batch_size=args.compute_batch_size, shuffle=False
+            validation_dataset, batch_size=args.compute_batch_size, shuffle=False,
+            **dataloader_kwargs(args)
         )
 
     # build (and load) a model
@@ -153,9 +160,10 @@ def train(args):
 
     # train and validation loop
     epoch = initial_epoch
-    optimizer.zero_grad()
+    optimizer.zero_grad(set_to_none=True)
     for epoch in range(initial_epoch+1, initial_epoch+args.epoch+1):
-        sum_loss = 0
+        # accumulated on device. read back only when printed
+        sum_loss = torch.zeros((), device=args.device)
         total_batch = 0
         ave_loss = 0
         last_output_len = 0
@@ -163,7 +171,7 @@ def train(args):
             train_dataset.shuffle()
         model.train()
         for step, batch in enumerate(train_loader, 1):
-            batch = batch.to(args.device)
+            batch = batch.to(args.device, non_blocking=True)
             if not args.sync:
 
                 scale = 10 ** (torch.rand(
@@ -179,24 +187,26 @@ def train(args):
             y_pred = model(batch.sum(dim=1))
             loss = compute_loss(batch, y_pred, args.stft_setting,
                                 args.loss_function, args.permutation_free)
-            sum_loss += loss.item() * batch.shape[0]
+            sum_loss += loss.detach() * batch.shape[0]
             total_batch += batch.shape[0]
-            ave_loss = sum_loss / total_batch
             # perform a backward pass
             loss = loss / (args.batch_size // args.compute_batch_size)
             loss.backward()
             if step % (args.batch_size // args.compute_batch_size) == 0:
                 # update the weights.
                 optimizer.step()
-                optimizer.zero_grad()
+                optimizer.zero_grad(set_to_none=True)
                 # Print learning statistics
                 print_step = step // (args.batch_size // args.compute_batch_size)
-                curr_output = f'\repoch {epoch} step {print_step} loss={ave_loss}'
-                sys.stdout.write('\r' + ' ' * last_output_len)
-                sys.stdout.write(curr_output)
-                sys.stdout.flush()
-                last_output_len = len(curr_output)
+                if print_step % args.log_interval == 0:
+                    ave_loss = sum_loss.item() / total_batch
+                    curr_output = f'\repoch {epoch} step {print_step} loss={ave_loss}'
+                    sys.stdout.write('\r' + ' ' * last_output_len)
+                    sys.stdout.write(curr_output)
+                    sys.stdout.flush()
+                    last_output_len = len(curr_output)
 
+        ave_loss = sum_loss.item() / total_batch
         if step % (args.batch_size // args.compute_batch_size) != 0:
             # update the weights.
             optimizer.step()
@@ -207,16 +217,16 @@ def train(args):
             sys.stdout.write(curr_output)
             sys.stdout.flush()
             last_output_len = len(curr_output)
-        optimizer.zero_grad()
+        optimizer.zero_grad(set_to_none=True)
 
         if args.validation_dir is not None:
             model.eval()
             with torch.no_grad():
-                sum_val_loss = 0
+                sum_val_loss = torch.zeros((), device=args.device)
                 total_batch = 0
                 for batch in validation_loader:
 
-                    batch = batch.to(args.device)
+                    batch = batch.to(args.device, non_blocking=True)
                     scale = 1. / torch.max(
                         batch.abs(), dim=-1)[0].clamp(min=1e-32)
 
@@ -231,9 +241,9 @@ def train(args):
                     y_pred = model(batch.sum(dim=1))
                     loss = compute_loss(batch, y_pred, args.stft_setting,
                                         args.loss_function, args.permutation_free)
-                    sum_val_loss += loss.item() * batch.shape[0]
+                    sum_val_loss += loss * batch.shape[0]
                     total_batch += batch.shape[0]
-            ave_val_loss = sum_val_loss / total_batch
+            ave_val_loss = sum_val_loss.item() / total_batch
             sys.stdout.write('\r' + ' ' * last_output_len)
             sys.stdout.write(f'\repoch {epoch} loss={ave_loss} val={ave_val_loss}\n')
     # end of epoch loop
@@ -4,7 +4,6 @@ import sys
 import math
 
 import torch
-import torchaudio
 
 try:
     import torchchimera
@@ -44,10 +43,11 @@ class Stft(torch.nn.Module):
             self.stft_setting.n_fft,
             self.stft_setting.hop_length,
             self.stft_setting.win_length,
-            window=self.stft_setting.window
+            window=self.stft_setting.window,
+            return_complex=True
         )
-        _, freq, time, _ = y.shape
-        return y.reshape(*x.shape[:-1], freq, time, 2)
+        _, freq, time = y.shape
+        return y.reshape(*x.shape[:-1], freq, time)
 
 class Istft(torch.nn.Module):
     def __init__(self, stft_setting):
@@ -55,16 +55,16 @@ class Istft(torch.nn.Module):
         self.stft_setting = stft_setting
 
     def forward(self, x):
-        freq, time = x.shape[-3], x.shape[-2]
-        y = torchaudio.functional.istft(
-            x.reshape(x.shape[:-3].numel(), freq, time, 2),
+        freq, time = x.shape[-2], x.shape[-1]
+        y = torch.istft(
+            x.reshape(x.shape[:-2].numel(), freq, time),
             self.stft_setting.n_fft,
             self.stft_setting.hop_length,
             self.stft_setting.win_length,
             window=self.stft_setting.window
         )
         waveform_length = y.shape[-1]
-        return y.reshape(*x.shape[:-3], waveform_length)
+        return y.reshape(*x.shape[:-2], waveform_length)
 
 class AdaptedChimeraMagPhasebook(torch.nn.Module):
     def __init__(self, chimera, stft_setting):
@@ -73,22 +73,16 @@ class AdaptedChimeraMagPhasebook(torch.nn.Module):
         self.stft_setting = stft_setting
 
     def forward(self, x, states=None):
-        def comp_mul(X, Y):
-            (X_re, X_im), (Y_re, Y_im) = X.unbind(-1), Y.unbind(-1)
-            return torch.stack((
-                X_re * Y_re - X_im * Y_im,
-                X_re * Y_im + X_im * Y_re
-            ), dim=-1)
         stft = Stft(self.stft_setting)
         istft = Istft(self.stft_setting)
 
         X = stft(x)
 
         embd, (com,), out_status = self.chimera(
-            10 * torch.log10(torch.sum(X**2, dim=-1).clamp(min=1e-40)),
+            10 * torch.log10((X.abs() ** 2).clamp(min=1e-40)),
             states=states, outputs=['com']
         )
-        shat = istft(comp_mul(com, X.unsqueeze(1)))
+        shat = istft(com * X.unsqueeze(1))
         return embd, com, shat, out_status
 
 class AdaptedChimeraMagPhasebookWithMisi(torch.nn.Module):
@@ -101,23 +95,23 @@ class AdaptedChimeraMagPhasebookWithMisi(torch.nn.Module):
     def forward(self, x, states=None):
         X = Stft(self.stft_setting)(x)
         embd, (com,), out_status = self.chimera(
-            10 * torch.log10(torch.sum(X**2, dim=-1).clamp(min=1e-40)),
+            10 * torch.log10((X.abs() ** 2).clamp(min=1e-40)),
             states=states, outputs=['com']
         )
         shat = self.misi(com, x)
         return embd, com, shat, out_status
 
 def dc_label_matrix(S):
-    batch_size, n_channels, freq_bins, spec_time, _ = S.shape
-    S_abs = S.norm(p=2, dim=-1)
+    batch_size, n_channels, freq_bins, spec_time = S.shape
+    S_abs = S.abs()
     p = S_abs.transpose(1, 3).reshape(batch_size, spec_time*freq_bins, n_channels).softmax(dim=-1).cumsum(dim=-1)
     r = torch.rand(batch_size, spec_time * freq_bins, device=S.device)
-    k = torch.eye(n_channels, device=S.device)[torch.argmin(torch.where(r.unsqueeze(-1) <= p, p, torch.ones_like(p)), dim=-1)]
+    k = torch.nn.functional.one_hot(torch.argmin(torch.where(r.unsqueeze(-1) <= p, p, torch.ones_like(p)), dim=-1), num_classes=n_channels).to(S.real.dtype)
     return k
 
 def dc_weight_matrix(X):
-    batch_size, freq_bins, spec_time, _ = X.shape
-    X_abs = X.norm(p=2, dim=-1)
+    batch_size, freq_bins, spec_time = X.shape
+    X_abs = X.abs()
     weight = X_abs.transpose(1, 2).reshape(batch_size, spec_time*freq_bins)\
         / X_abs.sum(dim=(1, 2)).clamp(min=1e-16).unsqueeze(-1)
     return weight
@@ -134,7 +128,7 @@ def compute_loss(s, y_pred, stft_setting,
         weight = dc_weight_matrix(X)
         alpha = 0.975
         loss_dc = alpha * loss_dc_deep_lda(embd, Y, weight)
-        mag = torch.sum(com**2, dim=-1)
+        mag = com.abs() ** 2
         if is_permutation_free:
             loss_mi = (1-alpha) * permutation_free(loss_mi_tpsa)(mag, X, S, gamma=2.)
         else:
@@ -183,10 +177,10 @@ def compute_loss(s, y_pred, stft_setting,
 def exclude_silence(s, stft_setting, cutoff_rms):
     stft = Stft(stft_setting)
     S = stft(s.squeeze(0))
-    S_pow = torch.sum(stft(s.squeeze(0))**2, dim=-1)
+    S_pow = S.abs() ** 2
     rms = 10 * torch.log10(torch.mean(S_pow, dim=1))
     is_no_silence = torch.all(rms > cutoff_rms, dim=0)
-    S = S[:, :, is_no_silence, :]
+    S = S[:, :, is_no_silence]
     if S.shape[2] < 4: # 4: n_fft // hop_length
         return None
     istft = Istft(stft_setting)
@@ -0,0 +1,63 @@
+#!/usr/bin/env python
+
+import os
+import sys
+from argparse import ArgumentParser
+
+import numpy as np
+import resampy
+import soundfile
+
+try:
+    import torchchimera
+except:
+    # attempts to import local module
+    sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+    import torchchimera
+from torchchimera.datasets import DSD100
+
+'''
+Resamples every source of DSD100 once and saves it next to the wav file
+as a mono float32 npy file, which DSD100(..., sr=sr) reads with mmap
+'''
+
+def parse_args():
+    parser = ArgumentParser()
+    parser.add_argument('root_dir', help='root directory of DSD100')
+    parser.add_argument('--split', nargs='+', default=['Dev', 'Test'], help='splits to precache')
+    parser.add_argument('--sr', type=int, default=16000, help='sampling rate')
+    parser.add_argument('--sources', nargs='+', default=['bass', 'drums', 'other', 'vocals'], help='source names')
+    args = parser.parse_args()
+    if args.sr <= 0:
+        parser.error('--sr is positive')
+    for split in args.split:
+        if not os.path.isdir(os.path.join(args.root_dir, 'Sources', split)):
+            parser.error(f'"{split}" is not a split of {args.root_dir}')
+    return args
+
+def main():
+    args = parse_args()
+    for split in args.split:
+        parent_dir = os.path.join(args.root_dir, 'Sources', split)
+        source_dirs = sorted(filter(
+            lambda d: os.path.isdir(d),
+            map(lambda d: os.path.join(parent_dir, d), os.listdir(parent_dir))
+        ))
+        for i, d in enumerate(source_dirs, 1):
+            for s in args.sources:
+                wave, rate = soundfile.read(
+                    os.path.join(d, s+'.wav'), dtype='float32', always_2d=True)
+                wave = wave.mean(axis=1)
+                if rate != args.sr:
+                    # same resampler as DSD100 uses for non-precached songs
+                    wave = resampy.resample(wave, rate, args.sr, axis=-1)
+                np.save(
+                    DSD100.precached_path(d, s, args.sr),
+                    wave.astype('float32')
+                )
+            sys.stdout.write(f'\r{split} {i}/{len(source_dirs)}')
+            sys.stdout.flush()
+        sys.stdout.write('\n')
+
+if __name__ == '__main__':
+    main()
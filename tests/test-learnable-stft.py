@@ -1,6 +1,5 @@
 #!/usr/bin/env python
 import torch
-import torchaudio
 import matplotlib.pyplot as plt
 from math import pi
 from layers import TrainableStftLayer, TrainableIstftLayer
@@ -11,15 +10,13 @@ def main():
     torch.sin(2 * pi * torch.linspace(0, 200, window_length)).unsqueeze(0)
     l1 = TrainableStftLayer(n_fft)
     l2 = TrainableIstftLayer(n_fft)
-    X, Xhat = torch.stft(x, n_fft), l1(x.unsqueeze(1))
-    y, yhat = torchaudio.functional.istft(X, n_fft), l2(Xhat)
+    X, Xhat = torch.stft(x, n_fft, return_complex=True), l1(x.unsqueeze(1))
+    y, yhat = torch.istft(X, n_fft), l2(Xhat)
     print(X.shape, Xhat.shape)
     print(y.shape, yhat.shape)
 
-    time = Xhat.shape[-1]
-    Xhat = Xhat.reshape(1, 2, n_fft//2+1, time).permute((0, 2, 3, 1))
-    X = X.detach().numpy()[0, :, :, 1]
-    Xhat = Xhat.detach().numpy()[0, :, :, 1]
+    X = X.imag.detach().numpy()[0]
+    Xhat = Xhat.imag.detach().numpy()[0]
     yhat = yhat.detach().numpy()[0]
 
     '''
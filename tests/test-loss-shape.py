@@ -1,6 +1,7 @@
 #!/usr/bin/env python
 
 import torch
+from math import pi
 from losses import *
 
 batch_size = 16
@@ -14,8 +15,8 @@ embd = torch.randn(batch_size, time*freq_bin, embd_dim)
 label = torch.randn(batch_size, time*freq_bin, n_channels)
 
 mask = torch.randn(batch_size, n_channels, freq_bin, time)
-mixture = torch.randn(batch_size, freq_bin, time, 2)
-sources = torch.randn(batch_size, n_channels, freq_bin, time, 2)
+mixture = torch.randn(batch_size, freq_bin, time, dtype=torch.cfloat)
+sources = torch.randn(batch_size, n_channels, freq_bin, time, dtype=torch.cfloat)
 
 waveform_true = torch.randn(batch_size, n_channels, waveform_length)
 waveform_pred = torch.randn(batch_size, n_channels, waveform_length)
@@ -27,3 +28,29 @@ print(loss_mi_msa(mask, mixture, sources))
 print(loss_mi_tpsa(mask, mixture, sources))
 
 print(loss_wa(waveform_pred, waveform_true))
+
+print(permutation_free(loss_mi_msa)(mask, mixture, sources))
+print(permutation_free(loss_mi_tpsa)(mask, mixture, sources))
+
+print(permutation_free(loss_wa)(waveform_pred, waveform_true))
+
+phasep = torch.randn(batch_size, n_channels, freq_bin, time, 8).softmax(dim=-1)
+phasebook = 2 * pi * torch.arange(-3, 5) / 8
+print(loss_ce_phase(phasep, mixture, sources, phasebook))
+print(permutation_free(loss_ce_phase)(phasep, mixture, sources, phasebook))
+
+# pairwise costs agree with the per-permutation loop
+# (a lambda is not in the pairwise table, so it takes the loop path)
+com = torch.randn(batch_size, n_channels, freq_bin, time, dtype=torch.cfloat)
+for loss_function, args, kwargs in (
+        (loss_mi_msa, (mask, mixture, sources), {}),
+        (loss_mi_tpsa, (mask, mixture, sources), {}),
+        (loss_wa, (waveform_pred, waveform_true), {}),
+        (loss_ce_phase, (phasep, mixture, sources), {'phasebook': phasebook}),
+        (loss_csa, (com, mixture, sources), {}),
+):
+    loss_pairwise = permutation_free(loss_function)(*args, **kwargs)
+    loss_loop = permutation_free(
+        lambda *a, **k: loss_function(*a, **k))(*args, **kwargs)
+    print(loss_function.__name__, loss_pairwise, loss_loop)
+    assert torch.allclose(loss_pairwise, loss_loop, rtol=1e-4)
@@ -1,6 +1,5 @@
 #!/usr/bin/env python
 import torch
-import torchaudio
 import matplotlib.pyplot as plt
 from math import pi
 from layers import MisiNetwork, TrainableMisiNetwork
@@ -16,17 +15,17 @@ def main():
     model = TrainableMisiNetwork(n_fft, 0)
     S = torch.stft(
         s.reshape(10, window_length),
-        n_fft, window=torch.hann_window(n_fft)
+        n_fft, window=torch.hann_window(n_fft), return_complex=True
     )
-    _, freq_bins, spec_time, _ = S.shape
-    S = S.reshape(5, 2, freq_bins, spec_time, 2)
-    X = torch.stft(x, n_fft, window=torch.hann_window(n_fft))
-    Smag, Xmag = S.norm(2, -1), X.norm(2, -1)
+    _, freq_bins, spec_time = S.shape
+    S = S.reshape(5, 2, freq_bins, spec_time)
+    X = torch.stft(
+        x, n_fft, window=torch.hann_window(n_fft), return_complex=True)
+    Smag, Xmag = S.abs(), X.abs()
     mask = 10 ** (torch.log10(Smag.clamp(min=1e-36)) -\
         torch.log10(Xmag.clamp(min=1e-24).unsqueeze(1)))
-    sbar = torchaudio.functional.istft(
-        (mask.unsqueeze(-1) * X.unsqueeze(1))
-        .reshape(10, freq_bins, spec_time, 2),
+    sbar = torch.istft(
+        (mask * X.unsqueeze(1)).reshape(10, freq_bins, spec_time),
         n_fft,
         window=torch.hann_window(n_fft)
     ).reshape(5, 2, window_length)
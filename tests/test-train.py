@@ -1,89 +1,113 @@
 #!/usr/bin/env python
 
+import os
 import sys
 import math
+import contextlib
 import torch
-import torchaudio
 from datasets import DSD100, MixTransform
 from models import ChimeraClassic
 from models import ChimeraPlusPlus
 from models import ChimeraMagPhasebook
 from losses import loss_mi_tpsa, loss_dc_whitend, loss_wa, loss_ce_phase, loss_csa
-from layers import MisiNetwork
+from layers import TrainableMisiNetwork
 
 def main():
     batch_size = 16
-    orig_freq = 44100
     target_freq = 16000
     seconds = 5
+    device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
 
     n_fft = 512
     win_length = 512
     hop_length = 128
-    freq_bins, spec_time, _ = torch.stft(
+    freq_bins, spec_time = torch.stft(
         torch.Tensor(seconds * target_freq), n_fft, hop_length, win_length,
-        window=torch.hann_window(n_fft)
+        window=torch.hann_window(n_fft), return_complex=True
     ).shape
 
+    # waveforms are precached at target_freq by scripts/precache-dsd100.py
     dataset = DSD100(
-        '/Volumes/Buffalo 2TB/Datasets/DSD100', 'Dev', seconds * orig_freq)
+        '/Volumes/Buffalo 2TB/Datasets/DSD100', 'Dev', seconds * target_freq,
+        sr=target_freq)
+    # same guard as dataloader_kwargs in scripts/_script_common.py
+    num_workers = (os.cpu_count() or 2) // 2
+    loader_kwargs = {
+        'num_workers': num_workers, 'pin_memory': device.type == 'cuda'
+    }
+    if num_workers > 0:
+        loader_kwargs['persistent_workers'] = True
+        loader_kwargs['prefetch_factor'] = 4
     dataloader = torch.utils.data.DataLoader(
-        dataset, batch_size=batch_size, num_workers=8, shuffle=True)
-    transforms = [
-        MixTransform([(0, 1, 2), 3, (0, 1, 2, 3)]),
-        lambda x: x.reshape(x.shape[0] * 3, seconds * orig_freq),
-        torchaudio.transforms.Resample(orig_freq, target_freq),
-        lambda x: x.reshape(x.shape[0] // 3, 3, seconds * target_freq),
-    ]
-    def transform(x):
-        for t in transforms:
-            x = t(x)
-        return x
+        dataset, batch_size=batch_size, shuffle=True, drop_last=True,
+        **loader_kwargs)
+    # workers only read raw waveforms. mixing runs batched on the device
+    # (B, 4, W) -> (B, 3, W): accompaniment, vocals, mixture
+    transform = MixTransform([(0, 1, 2), 3, (0, 1, 2, 3)]).to(device)
 
+    window = torch.hann_window(n_fft, device=device)
     stft = lambda x: torch.stft(
             x.reshape(x.shape[:-1].numel(), seconds * target_freq),
-            n_fft, hop_length, win_length, window=torch.hann_window(n_fft)
-        ).reshape(*x.shape[:-1], freq_bins, spec_time, 2)
-    comp_mul = lambda X, Y: torch.stack(
-        (X.unbind(-1)[0] * Y.unbind(-1)[0] - X.unbind(-1)[1] * Y.unbind(-1)[1],
-         X.unbind(-1)[0] * Y.unbind(-1)[1] + X.unbind(-1)[1] * Y.unbind(-1)[0]),
-        dim=-1
-    )
+            n_fft, hop_length, win_length, window=window,
+            return_complex=True
+        ).reshape(*x.shape[:-1], freq_bins, spec_time)
 
     initial_model = None #'model-dc.pth'
     initial_epoch = 20 # start at 0
     train_epoch = 10
     loss_function = 'wave' # 'chimera++', 'mask', 'wave'
     n_misi_layers = 1
+    log_interval = 50 # steps between (synchronizing) statistics output
     model = ChimeraMagPhasebook(freq_bins, spec_time, 2, 20, N=600)
     if initial_model is not None:
         model.load_state_dict(torch.load(initial_model))
     if initial_epoch > 0:
         model.load_state_dict(torch.load(f'model_epoch{initial_epoch-1}.pth'))
+    model.to(device)
     optimizer = torch.optim.Adam(model.parameters(), lr=1e-4)
-    misiLayer = MisiNetwork(n_fft, hop_length, win_length, layer_num=n_misi_layers)
+    # model is kept for state_dict (compiled module prefixes its keys)
+    # torch.compile (torch>=2.0) and torch.autocast (torch>=1.10) are
+    # skipped on older versions
+    compiled_model = torch.compile(model, mode='reduce-overhead')\
+        if hasattr(torch, 'compile') else model
+    use_amp = device.type == 'cuda' and hasattr(torch, 'autocast')
+    autocast = (lambda: torch.autocast('cuda', dtype=torch.bfloat16))\
+        if use_amp else contextlib.nullcontext
+    # conv-based stft/istft (hop_length = n_fft // 4)
+    misiLayer = TrainableMisiNetwork(
+        n_fft, layer_num=n_misi_layers, share_weight=True)
+    misiLayer.to(device)
 
     for epoch in range(initial_epoch, initial_epoch+train_epoch):
-        sum_loss = 0
+        sum_loss = torch.zeros((), device=device)
         total_batch = 0
         last_output_len = 0
-        for step, batch in enumerate(dataloader):
+        for step, (batch, _) in enumerate(dataloader):
+            batch = batch.to(device, non_blocking=True)
             batch = transform(batch)
             x, s = batch[:, 2, :], batch[:, :2, :]
-            X, S = stft(x), stft(s)
-            X_abs = torch.sqrt(torch.sum(X**2, dim=-1))
-            X_phase = X / X_abs.clamp(min=1e-12).unsqueeze(-1)
-            S_abs = torch.sqrt(torch.sum(S**2, dim=-1))
-            S_phase = S / S_abs.clamp(min=1e-12).unsqueeze(-1)
-            Y = torch.eye(2)[
+            XS = stft(batch)
+            X, S = XS[:, 2], XS[:, :2]
+            X_abs = X.abs()
+            X_phase = X / X_abs.clamp(min=1e-12)
+            S_abs = S.abs()
+            S_phase = S / S_abs.clamp(min=1e-12)
+            Y = torch.nn.functional.one_hot(
                 torch.argmax(S_abs, dim=1)
-                .reshape(batch.shape[0], freq_bins*spec_time)
-            ]
-
-            embd, (mask, phasep, com) = model(
-                torch.log10(X_abs.clamp(min=1e-12)),
-                outputs=['mag', 'phasep', 'com']
-            )
+                .reshape(batch.shape[0], freq_bins*spec_time),
+                num_classes=2
+            ).float()
+
+            # forward in bf16. stft/istft and the losses stay in fp32
+            # (complex mask is built outside: no complex bf16)
+            with autocast():
+                embd, (mask, phasep, phase), _ = compiled_model(
+                    torch.log10(X_abs.clamp(min=1e-12)),
+                    outputs=['mag', 'phasep', 'phase']
+                )
+            embd, mask, phasep, phase = \
+                embd.float(), mask.float(), phasep.float(), phase.float()
+            com = torch.polar(mask, phase)
 
             # compute loss
             if loss_function == 'chimera++':
@@ -93,31 +117,32 @@ def main():
                 loss = 0.5 * loss_mi_tpsa(mask, X, S, gamma=2.) \
                     + 0.5 * loss_csa(com, X, S)
             elif loss_function == 'wave':
-                Shat = comp_mul(com, X.unsqueeze(1))
-                shat = misiLayer(Shat, x)
+                shat = misiLayer(com, x)
                 loss = loss_wa(shat, s)
 
-            sum_loss += loss.item()
-            total_batch += batch.shape[0]
-            ave_loss = sum_loss / total_batch
-
             # Zero gradients, perform a backward pass, and update the weights.
+            optimizer.zero_grad(set_to_none=True)
             loss.backward()
             optimizer.step()
-            sum_grad = sum(
-                torch.sum(torch.abs(p.grad))
-                for p in model.parameters() if p.grad is not None
-            )
-            optimizer.zero_grad()
-
+            sum_loss += loss.detach()
+            total_batch += batch.shape[0]
             # Print learning statistics
-            curr_output =\
-                f'\repoch {epoch} step {step} loss={ave_loss} grad={sum_grad}'
-            sys.stdout.write('\r' + ' ' * last_output_len)
-            sys.stdout.write(curr_output)
-            sys.stdout.flush()
-            last_output_len = len(curr_output)
-
+            if step % log_interval == 0:
+                grads = [p.grad for p in model.parameters() if p.grad is not None]
+                sum_grad = torch.stack(
+                    torch._foreach_norm(grads, 1)
+                    if hasattr(torch, '_foreach_norm') else
+                    [g.norm(1) for g in grads]
+                ).sum().item()
+                ave_loss = sum_loss.item() / total_batch
+                curr_output =\
+                    f'\repoch {epoch} step {step} loss={ave_loss} grad={sum_grad}'
+                sys.stdout.write('\r' + ' ' * last_output_len)
+                sys.stdout.write(curr_output)
+                sys.stdout.flush()
+                last_output_len = len(curr_output)
+
+        ave_loss = sum_loss.item() / total_batch
         curr_output =\
             f'\repoch {epoch} loss={ave_loss}'
         sys.stdout.write('\r' + ' ' * last_output_len)
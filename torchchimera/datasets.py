@@ -5,9 +5,10 @@ import bisect
 import pathlib
 import random
 
+import numpy as np
 import torch
-import torchaudio
 import resampy
+import soundfile
 
 class Folder(torch.utils.data.Dataset):
     def __init__(self, root_dir, sr, duration=None, transform=None):
@@ -20,16 +21,12 @@ class Folder(torch.utils.data.Dataset):
         self.paths = sorted(list(pathlib.Path(root_dir).glob('**/*.wav')))
 
         for p in self.paths:
-            si, _ = torchaudio.info(str(p))
-            self.rates.append(si.rate)
+            si = soundfile.info(str(p))
+            self.rates.append(si.samplerate)
             if self.duration is None:
                 self.offsets.append(self.offsets[-1] + 1)
                 continue
-            if torchaudio.get_audio_backend() in ('sox', 'sox_io'):
-                n_frames = si.length // si.channels
-            elif torchaudio.get_audio_backend() == 'soundfile':
-                n_frames = si.length
-            n_segments = math.floor(n_frames / si.rate / self.duration)
+            n_segments = math.floor(si.frames / si.samplerate / self.duration)
             self.offsets.append(self.offsets[-1] + n_segments)
 
     def __len__(self):
@@ -40,14 +37,15 @@ class Folder(torch.utils.data.Dataset):
         offset_idx = idx - self.offsets[audio_idx]
         if self.duration is None:
             offset = 0
-            num_frames = 0
+            num_frames = -1
         else:
             offset = offset_idx * int(self.duration * self.rates[audio_idx])
             num_frames = int(self.rates[audio_idx] * self.duration)
-        x, _ = torchaudio.load(
-            str(self.paths[audio_idx]), offset=offset, num_frames=num_frames
+        x, _ = soundfile.read(
+            str(self.paths[audio_idx]), frames=num_frames, start=offset,
+            dtype='float32', always_2d=True
         )
-        x = x.mean(dim=0)
+        x = torch.from_numpy(x.mean(axis=1))
         if x.shape[-1] * self.sr / self.rates[audio_idx] < 1:
             x = torch.zeros((
                 *x.shape[:-1], math.ceil(self.rates[audio_idx] / self.sr)
@@ -96,11 +94,17 @@ class FolderTuple(torch.utils.data.Dataset):
 class DSD100(torch.utils.data.Dataset):
     def __init__(self, root_dir, split, waveform_length,
                  sources=('bass', 'drums', 'other', 'vocals'),
-                 transform=None):
+                 transform=None, sr=None):
+        # if sr is given, waveforms are read from the precached npy files
+        # (see scripts/precache-dsd100.py) or resampled from wav files
         self.sources = sources
         self.waveform_length = waveform_length
+        self.sr = sr
         self.offsets = [0]
         self.rates = []
+        self.file_rates = []
+        self.precached = []
+        self._handles, self._handles_pid = {}, None
         self.parent_dir = os.path.join(root_dir, 'Sources', split)
         self.transform = transform
         self.source_dirs = sorted(filter(
@@ -111,14 +115,60 @@ class DSD100(torch.utils.data.Dataset):
             )
         ))
         self.max_length = 0 if waveform_length is None else waveform_length
-        for d in self.source_dirs:
-            si, _ = torchaudio.info(os.path.join(d, 'bass.wav'))
+        for d, (n_frames, rate) in zip(self.source_dirs, self._load_lengths()):
+            self.file_rates.append(rate)
+            self.precached.append(sr is not None and all(
+                os.path.isfile(DSD100.precached_path(d, s, sr))
+                for s in self.sources
+            ))
+            if self.precached[-1]:
+                n_frames = np.load(
+                    DSD100.precached_path(d, 'bass', sr), mmap_mode='r'
+                ).shape[-1]
+            elif sr is not None:
+                n_frames = math.ceil(n_frames * sr / rate)
+            if sr is not None:
+                rate = sr
             if waveform_length is None:
-                self.max_length = max(self.max_length, si.length // si.channels)
+                self.max_length = max(self.max_length, n_frames)
             offset_diff = 1 if self.waveform_length is None else\
-                math.ceil(si.length / si.channels / self.waveform_length)
+                math.ceil(n_frames / self.waveform_length)
             self.offsets.append(self.offsets[-1] + offset_diff)
-            self.rates.append(si.rate)
+            self.rates.append(rate)
+
+    def _load_lengths(self):
+        # (n_frames, rate) of each song is cached in the split directory
+        cache_path = os.path.join(self.parent_dir, '.lengths.pt')
+        lengths = torch.load(cache_path) if os.path.isfile(cache_path) else {}
+        if all(os.path.basename(d) in lengths for d in self.source_dirs):
+            return [lengths[os.path.basename(d)] for d in self.source_dirs]
+        for d in self.source_dirs:
+            si = soundfile.info(os.path.join(d, 'bass.wav'))
+            lengths[os.path.basename(d)] = (si.frames, si.samplerate)
+        try:
+            torch.save(lengths, cache_path)
+        except OSError:
+            pass
+        return [lengths[os.path.basename(d)] for d in self.source_dirs]
+
+    # file handles are kept open per process so that forked dataloader
+    # workers never share (and seek) the same handle
+    def _open_source(self, path):
+        if self._handles_pid != os.getpid():
+            self._handles, self._handles_pid = {}, os.getpid()
+        if path not in self._handles:
+            self._handles[path] = soundfile.SoundFile(path)
+        return self._handles[path]
+
+    def __getstate__(self):
+        # open handles are not picklable (spawned workers reopen them)
+        state = self.__dict__.copy()
+        state['_handles'], state['_handles_pid'] = {}, None
+        return state
+
+    @staticmethod
+    def precached_path(source_dir, source, sr):
+        return os.path.join(source_dir, f'{source}.{sr}.f32.npy')
 
     def __len__(self):
         return self.offsets[-1]
@@ -131,15 +181,12 @@ class DSD100(torch.utils.data.Dataset):
         offset_idx = idx - self.offsets[audio_idx]
         offset = 0 if self.waveform_length is None else\
             offset_idx * self.waveform_length
-        num_frames = 0 if self.waveform_length is None else\
+        num_frames = -1 if self.waveform_length is None else\
             self.waveform_length
         x = torch.stack([
-            torchaudio.load(
-                os.path.join(self.source_dirs[audio_idx], s+'.wav'),
-                offset=offset, num_frames=num_frames
-            )[0]
+            self._read_source(audio_idx, s, offset, num_frames)
             for s in self.sources
-        ]).mean(axis=1)
+        ])
         if self.waveform_length is not None and\
            x.shape[-1] < self.waveform_length:
             x = torch.cat((
@@ -151,6 +198,35 @@ class DSD100(torch.utils.data.Dataset):
             ), dim=-1)
         return x, self.rates[audio_idx]
 
+    def _read_source(self, audio_idx, source, offset, num_frames):
+        source_dir = self.source_dirs[audio_idx]
+        if self.precached[audio_idx]:
+            wave = np.load(
+                DSD100.precached_path(source_dir, source, self.sr),
+                mmap_mode='r'
+            )
+            end = None if num_frames < 0 else offset + num_frames
+            return torch.from_numpy(np.array(wave[offset:end]))
+
+        f = self._open_source(os.path.join(source_dir, source+'.wav'))
+        if self.sr is None:
+            f.seek(offset)
+            return torch.from_numpy(
+                f.read(num_frames, dtype='float32', always_2d=True).mean(1)
+            )
+        # not precached: read the corresponding frames and resample
+        rate = self.file_rates[audio_idx]
+        f.seek(math.floor(offset * rate / self.sr))
+        x = f.read(
+            -1 if num_frames < 0 else math.ceil(num_frames * rate / self.sr),
+            dtype='float32', always_2d=True
+        ).mean(1)
+        if x.shape[-1] * self.sr / rate < 1:
+            # too short to resample (e.g. the tail of the last segment)
+            x = np.pad(x, (0, math.ceil(rate / self.sr) - x.shape[-1]))
+        x = resampy.resample(x, rate, self.sr, axis=-1)
+        return torch.from_numpy(x if num_frames < 0 else x[:num_frames])
+
     def __getitem__(self, idx):
         if type(idx) == int:
             waveform, rate = self._get_single_item(idx)
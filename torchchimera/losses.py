@@ -1,6 +1,8 @@
+import functools
 import torch
 from math import pi
 from itertools import permutations
+from scipy.optimize import linear_sum_assignment
 
 # loss functions for deep clustering head
 # embd: (batch_size, time*freq_bin, embd_dim)
@@ -23,8 +25,9 @@ def loss_dc_deep_lda(embd, label, weight=None):
         label = label * weight
     C = label.shape[2]
     YtV = label.transpose(1, 2).bmm(embd)
-    YtY = label.transpose(1, 2).bmm(label) + 1e-24 * torch.eye(C, device=label.device)
-    return torch.sum((embd - label.bmm(YtY.inverse().bmm(YtV))) ** 2) \
+    YtY = label.transpose(1, 2).bmm(label) \
+        + 1e-24 * torch.eye(C, device=label.device, dtype=label.dtype)
+    return torch.sum((embd - label.bmm(torch.linalg.solve(YtY, YtV))) ** 2) \
         / torch.sum((embd - embd.mean(dim=-2, keepdims=True)) ** 2) \
         / embd.shape[0]
 
@@ -35,13 +38,15 @@ def loss_dc_whitened(embd, label, weight=None):
         label = label * weight
     C = label.shape[2]
     D = embd.shape[2]
-    VtV = embd.transpose(1, 2).bmm(embd) + 1e-24 * torch.eye(D)
+    VtV = embd.transpose(1, 2).bmm(embd) \
+        + 1e-24 * torch.eye(D, device=embd.device, dtype=embd.dtype)
     VtY = embd.transpose(1, 2).bmm(label)
-    YtY = label.transpose(1, 2).bmm(label) + 1e-24 * torch.eye(C)
-    return D - torch.trace(torch.sum(
-        VtV.inverse().bmm(VtY).bmm(YtY.inverse()).bmm(VtY.transpose(1, 2)),
-        dim=0
-    )) / embd.shape[0]
+    YtY = label.transpose(1, 2).bmm(label) \
+        + 1e-24 * torch.eye(C, device=label.device, dtype=label.dtype)
+    # trace(VtV^-1 VtY YtY^-1 YtV) without explicit inverses
+    A = torch.linalg.solve(VtV, VtY)
+    B = torch.linalg.solve(YtY, VtY.transpose(1, 2))
+    return D - torch.einsum('bij,bji->', A, B) / embd.shape[0]
 
 def loss_dc_whitened_(embd, label, weight=None):
     if type(weight) == torch.Tensor:
@@ -50,9 +55,10 @@ def loss_dc_whitened_(embd, label, weight=None):
         label = label * weight
     C = label.shape[2]
     D = embd.shape[2]
-    VtV = embd.transpose(1, 2).bmm(embd) + 1e-24 * torch.eye(D)
+    VtV = embd.transpose(1, 2).bmm(embd) \
+        + 1e-24 * torch.eye(D, device=embd.device, dtype=embd.dtype)
     try:
-        eigval, eigvec = torch.symeig(VtV, eigenvectors=True)
+        eigval, eigvec = torch.linalg.eigh(VtV)
     except:
         return loss_dc_whitened(embd, label)
     eigval = (eigval + eigval.abs()) / 2
@@ -61,10 +67,41 @@ def loss_dc_whitened_(embd, label, weight=None):
     V = embd.bmm(eigvec.bmm(torch.diag_embed(isqrteigval)).bmm(eigvec.transpose(1, 2)))
     Y = label
     YtV = Y.transpose(1, 2).bmm(V)
-    YtY = Y.transpose(1, 2).bmm(Y) + 1e-24 * torch.eye(C)
-    return torch.sum((V - Y.bmm(YtY.inverse()).bmm(YtV)) ** 2) / embd.shape[0]
+    YtY = Y.transpose(1, 2).bmm(Y) \
+        + 1e-24 * torch.eye(C, device=label.device, dtype=label.dtype)
+    return torch.sum((V - Y.bmm(torch.linalg.solve(YtY, YtV))) ** 2) / embd.shape[0]
+
+# all channel assignments for small C, built once per device
+# output: (C!, C) row k maps true j to pred, (C,) true index
+@functools.lru_cache(maxsize=None)
+def _permutation_index(C, device):
+    return (
+        torch.tensor(list(permutations(range(C))), device=device),
+        torch.arange(C, device=device)
+    )
+
+# cost: (batch_size, n_channels(pred), n_channels(true))
+# output: (batch_size,) the minimum total cost over channel assignments
+def _min_permutation_cost(cost):
+    C = cost.shape[-1]
+    if C <= 4:
+        perms, true_ind = _permutation_index(C, cost.device)
+        # cost of every assignment: (batch_size, C!)
+        return cost[:, perms, true_ind].sum(dim=-1).min(dim=-1)[0]
+    # hungarian algorithm for large C. gradient flows through gathered cost
+    col_ind = torch.stack([
+        torch.from_numpy(linear_sum_assignment(c.T)[1])
+        for c in cost.detach().cpu().numpy()
+    ]).to(cost.device)
+    return cost.gather(1, col_ind.unsqueeze(1)).squeeze(1).sum(dim=-1)
 
 def permutation_free(loss_function):
+    if loss_function in _pairwise_loss_functions:
+        pairwise_function = _pairwise_loss_functions[loss_function]
+        def _pairwise_loss_function(*args, **kwargs):
+            return torch.sum(
+                _min_permutation_cost(pairwise_function(*args, **kwargs)))
+        return _pairwise_loss_function
     def _loss_function(*args, **kwargs):
         return sum(
             min(
@@ -78,21 +115,30 @@ def permutation_free(loss_function):
 
 # loss functions for mask inference head
 # mask: (batch_size, n_channels, freq_bin, time)
-# source: (batch_size, n_channels, freq_bin, time, 2)
-# mixture: (batch_size, freq_bin, time, 2)
-# source and mixture are obtained from torch.stft
+# source: (batch_size, n_channels, freq_bin, time) complex
+# mixture: (batch_size, freq_bin, time) complex
+# source and mixture are obtained from torch.stft(..., return_complex=True)
 def loss_mi_msa(mask, mixture, sources):
     C = mask.shape[1]
-    abs_comp = lambda X: torch.sqrt(torch.sum(X**2, -1).clamp(min=1e-12))
-    phase_comp = lambda X: torch.atan2(*X.split(1, dim=-1)[::-1]).squeeze()
+    abs_comp = lambda X: X.abs().clamp(min=1e-12)
     abs_X = abs_comp(mixture)
     abs_S = abs_comp(sources)
     return torch.sum((mask * abs_X - abs_S) ** 2) / mask.shape[0]
 
-def loss_mi_tpsa(mask, mixture, sources, gamma=1, L=1):
-    C = mask.shape[1]
-    abs_comp = lambda X: torch.sqrt(torch.sum(X**2, -1).clamp(min=1e-12))
-    phase_comp = lambda X: torch.atan2(*X.split(1, dim=-1)[::-1]).squeeze(-1)
+# output: (batch_size, n_channels(pred), n_channels(true))
+def _pairwise_loss_mi_msa(mask, mixture, sources):
+    abs_comp = lambda X: X.abs().clamp(min=1e-12)
+    abs_X = abs_comp(mixture)
+    abs_S = abs_comp(sources)
+    return torch.sum(
+        (mask.unsqueeze(2) * abs_X[:, None, None] - abs_S.unsqueeze(1)) ** 2,
+        dim=(-2, -1)
+    )
+
+# output: (batch_size, 1, freq_bin, time), (batch_size, n_channels, freq_bin, time)
+def _tpsa_spectrum(mixture, sources, gamma):
+    abs_comp = lambda X: X.abs().clamp(min=1e-12)
+    phase_comp = lambda X: X.angle()
     abs_X = abs_comp(mixture.unsqueeze(1))
     phase_X = phase_comp(mixture.unsqueeze(1))
     abs_S = abs_comp(sources)
@@ -104,6 +150,11 @@ def loss_mi_tpsa(mask, mixture, sources, gamma=1, L=1):
         ),
         other=gamma*abs_X
     )
+    return abs_X, spectrum
+
+def loss_mi_tpsa(mask, mixture, sources, gamma=1, L=1):
+    C = mask.shape[1]
+    abs_X, spectrum = _tpsa_spectrum(mixture, sources, gamma)
 
     if L == 1:
         return torch.sum(torch.abs(mask * abs_X - spectrum)) / mask.shape[0]
@@ -112,29 +163,94 @@ def loss_mi_tpsa(mask, mixture, sources, gamma=1, L=1):
     else:
         raise NotImplementedError()
 
+# output: (batch_size, n_channels(pred), n_channels(true))
+def _pairwise_loss_mi_tpsa(mask, mixture, sources, gamma=1, L=1):
+    abs_X, spectrum = _tpsa_spectrum(mixture, sources, gamma)
+    diff = (mask * abs_X).unsqueeze(2) - spectrum.unsqueeze(1)
+
+    if L == 1:
+        return torch.sum(torch.abs(diff), dim=(-2, -1))
+    elif L == 2:
+        return torch.sum(diff ** L, dim=(-2, -1))
+    else:
+        raise NotImplementedError()
+
+# loss function for phasebook (cross entropy against the nearest phase)
+# phasep: (batch_size, n_channels, freq_bin, time, phasebook_size)
+# mixture: (batch_size, freq_bin, time) complex
+# sources: (batch_size, n_channels, freq_bin, time) complex
+# phasebook: (phasebook_size,)
+def loss_ce_phase(phasep, mixture, sources, phasebook):
+    ref_idx = _phasebook_index(mixture, sources, phasebook)
+    return -torch.sum(torch.log(
+        phasep.gather(-1, ref_idx.unsqueeze(-1)).clamp(min=1e-12)
+    )) / phasep.shape[0]
+
+# output: (batch_size, n_channels(pred), n_channels(true))
+def _pairwise_loss_ce_phase(phasep, mixture, sources, phasebook):
+    ref_idx = _phasebook_index(mixture, sources, phasebook)
+    batch_size, n_channels, freq_bin, time, book_size = phasep.shape
+    shape = (batch_size, n_channels, n_channels, freq_bin, time)
+    return -torch.sum(torch.log(
+        phasep.unsqueeze(2).expand(*shape, book_size)
+        .gather(-1, ref_idx.unsqueeze(1).unsqueeze(-1).expand(*shape, 1))
+        .clamp(min=1e-12)
+    ), dim=(-3, -2, -1))
+
+# index of the phasebook entry closest to the phase difference
+# between each source and the mixture
+# output: (batch_size, n_channels, freq_bin, time)
+def _phasebook_index(mixture, sources, phasebook):
+    # argmax of cos is the argmin of circular distance
+    phase_true = sources.angle() - mixture.unsqueeze(1).angle()
+    return torch.argmax(torch.cos(
+        phasebook.to(phase_true.device) - phase_true.unsqueeze(-1)
+    ), dim=-1)
+
 # loss for waveform approximation
 # source_pred: (batch_size, n_channels, waveform_length)
 # source_true: (batch_size, n_channels, waveform_length)
 def loss_wa(source_pred, source_true):
     return torch.sum(torch.abs(source_pred - source_true)) / source_pred.shape[0]
 
+# output: (batch_size, n_channels(pred), n_channels(true))
+def _pairwise_loss_wa(source_pred, source_true):
+    return torch.sum(
+        torch.abs(source_pred.unsqueeze(2) - source_true.unsqueeze(1)), dim=-1
+    )
+
 # loss function for spectrogram (complex domain)
-# com_pred: (batch_size, n_channels, freq_bin, spec_time, 2)
-# mixture: (batch_size, freq_bin, spec_time, 2)
-# sources: (batch_size, n_channels, freq_bin, spec_time, 2)
+# com_pred: (batch_size, n_channels, freq_bin, spec_time) complex
+# mixture: (batch_size, freq_bin, spec_time) complex
+# sources: (batch_size, n_channels, freq_bin, spec_time) complex
 def loss_csa(com_pred, mixture, sources, L=1):
-    comp_mul = lambda X, Y: torch.stack(
-        (X.unbind(-1)[0] * Y.unbind(-1)[0] - X.unbind(-1)[1] * Y.unbind(-1)[1],
-         X.unbind(-1)[0] * Y.unbind(-1)[1] + X.unbind(-1)[1] * Y.unbind(-1)[0]),
-        dim=-1
-    )
-    abs_comp = lambda X: torch.sqrt(torch.sum(X**2, -1).clamp(min=1e-12))
-    phase_comp = lambda X: torch.atan2(*X.split(1, dim=-1)[::-1]).squeeze(-1)
-    source_pred = comp_mul(com_pred, mixture.unsqueeze(1))
+    diff = (com_pred * mixture.unsqueeze(1) - sources).abs()
 
     if L == 1:
-        return torch.sum(abs_comp(source_pred - sources)) / com_pred.shape[0]
+        return torch.sum(diff) / com_pred.shape[0]
     elif L == 2:
-        return torch.sum(abs_comp(source_pred - sources) ** 2) / com_pred.shape[0]
+        return torch.sum(diff ** 2) / com_pred.shape[0]
     else:
         raise NotImplementedError()
+
+# output: (batch_size, n_channels(pred), n_channels(true))
+def _pairwise_loss_csa(com_pred, mixture, sources, L=1):
+    source_pred = com_pred * mixture.unsqueeze(1)
+    diff = (source_pred.unsqueeze(2) - sources.unsqueeze(1)).abs()
+
+    if L == 1:
+        return torch.sum(diff, dim=(-2, -1))
+    elif L == 2:
+        return torch.sum(diff ** 2, dim=(-2, -1))
+    else:
+        raise NotImplementedError()
+
+# permutation_free computes every (prediction, target) pair at once
+# for the loss functions listed here
+_pairwise_loss_functions = {
+    loss_mi_msa: _pairwise_loss_mi_msa,
+    loss_mi_tpsa: _pairwise_loss_mi_tpsa,
+    loss_wa: _pairwise_loss_wa,
+    loss_ce_phase: _pairwise_loss_ce_phase,
+    loss_csa: _pairwise_loss_csa,
+}
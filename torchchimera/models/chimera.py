@@ -214,14 +214,17 @@ class ChimeraMagPhasebook(torch.nn.Module):
     # ['mag', 'phasep', 'com'] for L_{CHI++}(=L_{DC}+L_{MI}), L_{MI}
     # ['com'] for L_{WA}, and waveform inference at test
     def forward(self, x, states=None, outputs=['mag', 'phasep', 'com']):
-        cossin = lambda x: torch.stack((torch.cos(x), torch.sin(x)), dim=-1)
         out_base, out_states = self.base(x, states)
         out_embed = self.embed_head(out_base)
         out_mag_base = self.mag_base(out_base)
         out_mag = self.mag_head(out_mag_base)
         out_phase_base = self.phase_base(out_base)
         out_phase = self.phase_head(out_phase_base)
-        out_com = out_mag.unsqueeze(-1) * cossin(out_phase)
+        # polar does not support reduced precision (e.g. under autocast)
+        float_dtype = torch.promote_types(out_mag.dtype, torch.float)
+        out_com = torch.polar(
+            out_mag.to(float_dtype), out_phase.to(float_dtype)
+        ) if 'com' in outputs else None
         out_masks = tuple(
             out_mag if mode == 'mag' else
             out_mag_base if mode == 'magp' else
@@ -252,10 +255,8 @@ class ChimeraCombook(torch.nn.Module):
         out_mask_base = self.mask_base(out_base)
         return\
             self.embed_head(out_base),\
-            torch.stack(
-                (
-                    self.re_mask_head(out_mask_base),
-                    self.im_mask_head(out_mask_base)
-                ),
-                dim=-1),\
+            torch.complex(
+                self.re_mask_head(out_mask_base),
+                self.im_mask_head(out_mask_base)
+            ),\
             out_states
@@ -1,6 +1,6 @@
 
+import functools
 import torch
-import torchaudio
 from math import ceil, pi
 
 class MisiLayer(torch.nn.Module):
@@ -11,34 +11,34 @@ class MisiLayer(torch.nn.Module):
         self.hop_length = hop_length
         self.win_length = win_length
         if window is None:
-            self.window = torch.sqrt(torch.hann_window(self.n_fft))
-        else:
-            self.window = window
-    # input: (batch_size * n_channels, freq_bins, spec_time, 2)
-    # input: (batch_size * n_channels, freq_bins, spec_time, 1)
+            window = torch.sqrt(torch.hann_window(self.n_fft))
+        self.register_buffer('window', window)
+    # input: (batch_size * n_channels, freq_bins, spec_time) complex
+    # input: (batch_size * n_channels, freq_bins, spec_time)
     # input: (batch_size, waveform_length)
-    # output: (batch_size * n_channels, freq_bins, spec_time, 2)
+    # output: (batch_size * n_channels, freq_bins, spec_time) complex
     def forward(self, Shat, Shatmag, mixture):
         batch_size, waveform_length = mixture.shape
-        n_channels, freq_bins, spec_time, _ = Shat.shape
+        n_channels, freq_bins, spec_time = Shat.shape
         n_channels //= batch_size
         waveform_length = mixture.shape[-1]
 
         stft = lambda x: torch.stft(
             x, self.n_fft, self.hop_length, self.win_length,
-            window=self.window
+            window=self.window, return_complex=True
         )
-        istft = lambda X: torchaudio.functional.istft(
+        istft = lambda X: torch.istft(
             X, self.n_fft, self.hop_length, self.win_length,
-            window=self.window
+            window=self.window, length=waveform_length
         )
 
-        shat = istft(Shat)
-        delta = mixture - torch.sum(
-            shat.reshape(batch_size, n_channels, waveform_length), dim=1
+        shat = istft(Shat).reshape(batch_size, n_channels, waveform_length)
+        delta = mixture - torch.sum(shat, dim=1)
+        tmp = stft(
+            (shat + delta.unsqueeze(1) / n_channels)
+            .reshape(batch_size * n_channels, waveform_length)
         )
-        tmp = stft(shat + delta.repeat_interleave(n_channels, 0) / n_channels)
-        phase = torch.nn.functional.normalize(tmp, p=2, dim=-1)
+        phase = tmp / tmp.abs().clamp(min=1e-12)
         return Shatmag * phase
 
 class MisiNetwork(torch.nn.Module):
@@ -47,45 +47,39 @@ class MisiNetwork(torch.nn.Module):
         self.n_fft = n_fft
         self.hop_length = hop_length
         self.win_length = win_length
-        self.layer_num = layer_num
         if window is None:
-            self.window = torch.sqrt(torch.hann_window(self.n_fft))
-        else:
-            self.window = window
+            window = torch.sqrt(torch.hann_window(self.n_fft))
+        self.register_buffer('window', window)
+        self.misi_layers = torch.nn.ModuleList([
+            MisiLayer(n_fft, hop_length, win_length, window)
+            for _ in range(layer_num)
+        ])
     def add_layer(self):
-        self.layer_num += 1
-    # input: (batch_size, n_channels, freq_bins, spec_time, 2)
+        self.misi_layers.append(MisiLayer(
+            self.n_fft, self.hop_length, self.win_length, self.window))
+    # input: (batch_size, n_channels, freq_bins, spec_time) complex or real
     # input: (batch_size, waveform_length)
     # output: (batch_size, n_channels, waveform_length)
     def forward(self, mask, mixture):
-        if len(mask.shape) == 4:
-            # assumes real mask. zero imaginary part
-            mask = torch.stack((mask, torch.zeros_like(mask)), dim=-1)
-        batch_size, n_channels, freq_bins, spec_time, _ = mask.shape
-        mask = mask.reshape(batch_size * n_channels, freq_bins, spec_time, _)
+        # real mask is treated as complex mask with zero imaginary part
+        batch_size, n_channels, freq_bins, spec_time = mask.shape
         waveform_length = mixture.shape[-1]
-        def comp_mul(X, Y):
-            xre, xim = X.unbind(-1)
-            yre, yim = Y.unbind(-1)
-            return torch.stack(
-                (xre*yre - xim*yim, xre*yim + xim*yre), dim=-1
-            )
 
         stft = lambda x: torch.stft(
             x.reshape(x.shape[:-1].numel(), waveform_length),
             self.n_fft, self.hop_length, self.win_length,
-            window=self.window
+            window=self.window, return_complex=True
         )
-        istft = lambda X: torchaudio.functional.istft(
+        istft = lambda X: torch.istft(
             X, self.n_fft, self.hop_length, self.win_length,
-            window=self.window
-        ).reshape(*X.shape[:-3], waveform_length)
+            window=self.window, length=waveform_length
+        ).reshape(*X.shape[:-2], waveform_length)
 
-        Shat = comp_mul(mask, stft(mixture).repeat_interleave(n_channels, 0))
-        Shatmag = Shat.norm(2, -1, keepdim=True)
-        for _ in range(self.layer_num):
-            Shat = MisiLayer(self.n_fft, self.hop_length, self.win_length)\
-                (Shat, Shatmag, mixture)
+        Shat = (mask * stft(mixture).unsqueeze(1))\
+            .reshape(batch_size * n_channels, freq_bins, spec_time)
+        Shatmag = Shat.abs()
+        for layer in self.misi_layers:
+            Shat = layer(Shat, Shatmag, mixture)
         return istft(Shat).reshape(batch_size, n_channels, waveform_length)
 
 def _generate_dft_matrix(n_fft):
@@ -93,9 +87,18 @@ def _generate_dft_matrix(n_fft):
     basis = torch.arange(n_fft // 2 + 1, dtype=torch.float).unsqueeze(-1)
     return torch.cat((torch.cos(phi*basis), torch.sin(phi*basis)))
 
+# initial weight of TrainableStftLayer and TrainableIstftLayer
+# output: (n_fft+2, 1, n_fft)
+# cached per n_fft; callers must only copy from it, never modify it in place
+@functools.lru_cache(maxsize=8)
+def _generate_stft_weight(n_fft):
+    return (
+        torch.sqrt(torch.hann_window(n_fft)) * _generate_dft_matrix(n_fft)
+    ).unsqueeze(1).contiguous()
+
 class TrainableStftLayer(torch.nn.Module):
     # XXX: padding amount in Conv1d
-    def __init__(self, n_fft):
+    def __init__(self, n_fft, weight=None):
         super(TrainableStftLayer, self).__init__()
         self.n_fft = n_fft
         self.hop_length = n_fft // 4
@@ -103,18 +106,23 @@ class TrainableStftLayer(torch.nn.Module):
             1, self.n_fft+2, self.n_fft, stride=self.hop_length, bias=False,
             padding=self.hop_length * 2)
 
-        weight = torch.sqrt(torch.hann_window(n_fft)) * _generate_dft_matrix(n_fft)
+        if weight is None:
+            weight = _generate_stft_weight(n_fft)
         with torch.no_grad():
-            self.conv.weight.copy_(weight.unsqueeze(1))
+            self.conv.weight.copy_(weight)
 
     # input: (batch_size * n_channels, 1, waveform_length)
-    # output: (batch_size * n_channels, 2*(n_fft//2+1), time)
+    # output: (batch_size * n_channels, n_fft//2+1, time) complex
+    # the sin rows give the conjugate: negated to match torch.stft
     def forward(self, x):
-        return self.conv(x)
+        y = self.conv(x)
+        re, im = y.reshape(y.shape[0], 2, self.n_fft//2+1, y.shape[-1])\
+            .unbind(1)
+        return torch.complex(re, -im)
 
 class TrainableIstftLayer(torch.nn.Module):
     # XXX: padding amount in ConvTranspose1d
-    def __init__(self, n_fft):
+    def __init__(self, n_fft, weight=None):
         super(TrainableIstftLayer, self).__init__()
         self.n_fft = n_fft
         self.hop_length = n_fft // 4
@@ -126,40 +134,43 @@ class TrainableIstftLayer(torch.nn.Module):
             padding=self.hop_length * 2
         )
 
-        weight = torch.sqrt(torch.hann_window(n_fft)) * _generate_dft_matrix(n_fft)
+        if weight is None:
+            weight = _generate_stft_weight(n_fft)
         with torch.no_grad():
-            self.conv.weight.copy_(weight.unsqueeze(1))
+            self.conv.weight.copy_(weight)
 
-    # input: (batch_size * n_channels, 2*(n_fft//2+1), time)
+    # input: (batch_size * n_channels, n_fft//2+1, time) complex
+    #        same sign convention as torch.stft
     # output: (batch_size * n_channels, 1, waveform_length)
     def forward(self, x):
-        return self.conv(x) / self.n_fft
+        return self.conv(torch.cat((x.real, -x.imag), dim=1)) / self.n_fft
 
 class TrainableMisiLayer(torch.nn.Module):
-    def __init__(self, n_fft, n_channels=None):
+    def __init__(self, n_fft, n_channels=None, weight=None):
         super(TrainableMisiLayer, self).__init__()
         self.n_fft = n_fft
         self.hop_length = n_fft // 4
         self.win_length = n_fft
         self.n_channels = n_channels
+        if weight is None:
+            weight = _generate_stft_weight(n_fft)
         if n_channels is None:
-            self.stft_layer = TrainableStftLayer(n_fft)
-            self.istft_layer = TrainableIstftLayer(n_fft)
+            self.stft_layer = TrainableStftLayer(n_fft, weight)
+            self.istft_layer = TrainableIstftLayer(n_fft, weight)
         else:
             self.stft_layer = torch.nn.ModuleList([
-                TrainableStftLayer(n_fft) for _ in range(n_channels)
+                TrainableStftLayer(n_fft, weight) for _ in range(n_channels)
             ])
             self.istft_layer = torch.nn.ModuleList([
-                TrainableIstftLayer(n_fft) for _ in range(n_channels)
+                TrainableIstftLayer(n_fft, weight) for _ in range(n_channels)
             ])
-    # input: (batch_size * n_channels, 2*(n_fft//2+1), spec_time)
-    # input: (batch_size * n_channels, 2*(n_fft//2+1), spec_time)
-    #        this input is obtained by mag.repeat(1, 2, 1)
+    # input: (batch_size * n_channels, n_fft//2+1, spec_time) complex
+    # input: (batch_size * n_channels, n_fft//2+1, spec_time)
     # input: (batch_size, waveform_length)
-    # output: (batch_size * n_channels, 2*(n_fft//2+1), spec_time)
+    # output: (batch_size * n_channels, n_fft//2+1, spec_time) complex
     def forward(self, Shat, Shatmag, mixture):
         batch_size, waveform_length = mixture.shape
-        n_channels, _, spec_time = Shat.shape
+        n_channels, freq_bins, spec_time = Shat.shape
         n_channels //= batch_size
 
         if self.n_channels is None:
@@ -168,7 +179,7 @@ class TrainableMisiLayer(torch.nn.Module):
             shat = torch.stack(
                 [l(b) for l, b in zip(
                     self.istft_layer,
-                    Shat.view(batch_size, n_channels, 2*(self.n_fft//2+1), spec_time).unbind(dim=1)
+                    Shat.view(batch_size, n_channels, freq_bins, spec_time).unbind(dim=1)
                 )],
                 dim=1
             ).view((batch_size * n_channels, 1, waveform_length)) # : (B*C, 1, W)
@@ -178,8 +189,10 @@ class TrainableMisiLayer(torch.nn.Module):
         ) # : (B, W)
         if self.n_channels is None:
             tmp = self.stft_layer(
-                shat + delta.repeat_interleave(n_channels, 0).unsqueeze(1) / n_channels
-            ) # : (B*C, 2*F, T)
+                (shat.view(batch_size, n_channels, waveform_length)
+                 + delta.unsqueeze(1) / n_channels)
+                .view(batch_size * n_channels, 1, waveform_length)
+            ) # : (B*C, F, T)
         else:
             tmp = torch.stack(
                 [
@@ -190,57 +203,56 @@ class TrainableMisiLayer(torch.nn.Module):
                     )
                 ],
                 dim=1
-            ).view((batch_size * n_channels, 2*(self.n_fft//2+1), spec_time)) # : (B*C, 2*F, T)
+            ).view((batch_size * n_channels, freq_bins, spec_time)) # : (B*C, F, T)
 
-        phase = torch.nn.functional.normalize(
-            tmp.reshape(batch_size*n_channels, 2, self.n_fft//2+1, spec_time),
-            p=2, dim=1
-        ).reshape(batch_size*n_channels, self.n_fft+2, spec_time)
+        phase = tmp / tmp.abs().clamp(min=1e-12)
         return Shatmag * phase
 
 class TrainableMisiNetwork(torch.nn.Module):
-    def __init__(self, n_fft, layer_num=1, n_channels=None):
+    def __init__(self, n_fft, layer_num=1, n_channels=None, share_weight=False):
         super(TrainableMisiNetwork, self).__init__()
         self.n_fft = n_fft
         self.hop_length = n_fft // 4
         self.win_length = n_fft
         self.n_channels = n_channels
-        self.stft_layer = TrainableStftLayer(n_fft)
+        self.share_weight = share_weight
+        # every sublayer is initialized from the same weight
+        weight = _generate_stft_weight(n_fft)
+        self.stft_layer = TrainableStftLayer(n_fft, weight)
         if n_channels is None:
-            self.istft_layer = TrainableIstftLayer(n_fft)
+            self.istft_layer = TrainableIstftLayer(n_fft, weight)
         else:
             self.istft_layer = torch.nn.ModuleList([
-                TrainableIstftLayer(n_fft) for _ in range(n_channels)
+                TrainableIstftLayer(n_fft, weight) for _ in range(n_channels)
             ])
         self.misi_layers = torch.nn.ModuleList([
-            TrainableMisiLayer(n_fft, n_channels) for _ in range(layer_num)
+            TrainableMisiLayer(n_fft, n_channels, weight)
+            for _ in range(layer_num)
         ])
+        if share_weight:
+            self._tie_weights()
     def add_layer(self):
         self.misi_layers.append(TrainableMisiLayer(self.n_fft, self.n_channels))
-    # input: (batch_size, n_channels, freq_bins, spec_time, 2)
+        if self.share_weight:
+            self._tie_weights()
+    # let every stft/istft layer use the weight of self.stft_layer.
+    # the shared weight is a fixed stft kernel: it is not trained
+    def _tie_weights(self):
+        self.stft_layer.conv.weight.requires_grad_(False)
+        for m in self.modules():
+            if isinstance(m, (TrainableStftLayer, TrainableIstftLayer)):
+                m.conv.weight = self.stft_layer.conv.weight
+    # input: (batch_size, n_channels, freq_bins, spec_time) complex or real
     # input: (batch_size, waveform_length)
     # output: (batch_size, n_channels, waveform_length)
     def forward(self, mask, mixture):
-        if len(mask.shape) == 4:
-            # assumes real mask. zero imaginary part
-            mask = torch.stack((mask, torch.zeros_like(mask)), dim=-1)
-        batch_size, n_channels, freq_bins, spec_time, _ = mask.shape
+        # real mask is treated as complex mask with zero imaginary part
+        batch_size, n_channels, freq_bins, spec_time = mask.shape
         waveform_length = mixture.shape[-1]
-        mask = mask.permute(0, 1, 4, 2, 3)\
-                   .reshape(batch_size * n_channels, 2, freq_bins, spec_time)
-        def comp_mul(X, Y):
-            xre, xim = X.unbind(1)
-            yre, yim = Y.unbind(1)
-            return torch.stack(
-                (xre*yre - xim*yim, xre*yim + xim*yre), dim=1
-            )
 
-        X = self.stft_layer(mixture.unsqueeze(1))\
-                .reshape(batch_size, 2, freq_bins, spec_time)\
-                .repeat_interleave(n_channels, 0)
-        Shat = comp_mul(mask, X)
-        Shatmag = Shat.norm(2, 1).repeat(1, 2, 1)
-        Shat = Shat.reshape(batch_size*n_channels, 2*freq_bins, spec_time)
+        X = self.stft_layer(mixture.unsqueeze(1)).unsqueeze(1) # : (B, 1, F, T)
+        Shat = (mask * X).reshape(batch_size*n_channels, freq_bins, spec_time)
+        Shatmag = Shat.abs()
         for layer in self.misi_layers:
             Shat = layer(Shat, Shatmag, mixture)
         if self.n_channels is None:
@@ -250,7 +262,6 @@ class TrainableMisiNetwork(torch.nn.Module):
             return torch.cat([
                 l(b) for l, b in zip(
                     self.istft_layer,
-                    Shat.view(batch_size, n_channels, 2*freq_bins, spec_time).unbind(dim=1)
+                    Shat.view(batch_size, n_channels, freq_bins, spec_time).unbind(dim=1)
                 )
             ], dim=1)
-
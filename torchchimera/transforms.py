@@ -38,25 +38,28 @@ class MixTransform(torch.nn.Module):
             ]
         else:
             self.source_coeffs = source_coeffs
+        # mixing matrix: (n_out, n_in)
+        n_in = max(int(sl.max()) for sl in self.source_lists) + 1
+        mix_matrix = torch.zeros(len(self.source_lists), n_in)
+        for k, (sl, sc) in enumerate(zip(self.source_lists, self.source_coeffs)):
+            mix_matrix[k].index_add_(0, sl, torch.as_tensor(sc, dtype=torch.float))
+        self.register_buffer('mix_matrix', mix_matrix)
 
     def forward(self, sample):
         # weighted sum along dim=-2 (dim=-1 are waveforms)
-        return torch.stack([
-            torch.sum(
-                sc.unsqueeze(-1) * sample.index_select(dim=-2, index=sl),
-                dim=-2
-            )
-            for sl, sc in zip(self.source_lists, self.source_coeffs)
-        ], dim=-2)
+        return torch.matmul(
+            self.mix_matrix.to(sample.dtype),
+            sample[..., :self.mix_matrix.shape[-1], :]
+        )
 
 class PitchShift(torch.nn.Module):
     def __init__(self, sampling_rate, shift_rate, n_fft=512):
         super(PitchShift, self).__init__()
         self.stft = lambda x: torch.stft(
             x, n_fft, hop_length=n_fft//4,
-            window=torch.hann_window(n_fft)
+            window=torch.hann_window(n_fft), return_complex=True
         )
-        self.istft = lambda x: torchaudio.functional.istft(
+        self.istft = lambda x: torch.istft(
             x, n_fft, hop_length=n_fft//4,
             window=torch.hann_window(n_fft)
         )